@@ -3,9 +3,10 @@
 Options:
   -B|--base=<float>     Set the power base (default 1kW)
   --color (str)         Set the node and link color (default by phase)
+  --force-reconvert     Convert GLM to JSON even if the JSON is up to date
   --install             Install this copy as the GridLAB-D tool
   -i|--input=<str>      Set the input file name (GLM or JSON)
-  -L|--layout=<str>     Choose the layout method (default "kamada_kawai")
+  -L|--layout=<str>     Choose the layout method (default "auto")
   -N|--nodeshape=<str>  Set the node shape (default by phase)
   -o|--output=<str>     Set the output file name
   -S|--show[=<bool>]    Show the image (default False)
@@ -19,13 +20,20 @@ Generate a network plot from a GLM or JSON file.  The 'base' option sets
 the power base used to set the width of links, which is logarithmic with
 the power base as width 1 and factors of 10 increasing the width by 1.
 The layout can be selected from among the layout allowed by the networkx
-module.  The nodeshape option specifies the shape of nodes. The nodesize 
-is an integer. The show option enables immediately showing a plot. The
-workdir option specifies the working folder.
-
-If the input file is not JSON, it is automatically converted to JSON. If
-the output file is not specified and the show option is not given, then
-the output file is set to the input file with the extension ".png".
+module.  The "auto" layout uses "kamada_kawai" on networks with up to 1000
+nodes.  On larger networks it removes outer leaf nodes until 1000 nodes
+remain, lays out the rest, and places the removed branches around the
+nodes they hang from.  Islands are laid out separately and placed side by
+side.  The nodeshape option
+specifies the shape of nodes. The nodesize is an integer. The show option
+enables immediately showing a plot. The workdir option specifies the
+working folder.
+
+If the input file is not JSON, it is automatically converted to JSON. The
+conversion is skipped if the JSON file is newer than the input file, unless
+the force-reconvert option is given. If the output file is not specified
+and the show option is not given, then the output file is set to the input
+file with the extension ".png".
 
 If no options are given and the folder "autotest" is found, then the
 autotest procedure is run on all the GLM files found in the folder.  The
@@ -38,13 +46,30 @@ as a caret, wye/neutral as a vee, otherwise as a circle. If you specify
 node shape, the phase information is ignored.
 """
 import os, sys
+import argparse
 import subprocess
-import json
+try:
+    import orjson as _json # faster JSON parser, only used to read models
+except ModuleNotFoundError:
+    import json as _json
 import math
+import numpy as np
+import scipy.optimize
+import scipy.sparse
+import scipy.sparse.csgraph
+try:
+    import numba
+except ModuleNotFoundError:
+    numba = None
 import networkx
 import matplotlib.pyplot as plt
+import matplotlib.collections
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import traceback
 import signal
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 BASENAME = os.path.splitext(os.path.basename(sys.argv[0]))[0]
 INPUTFILE = None
@@ -54,13 +79,19 @@ WORKDIR = "."
 OUTPUT = ""
 ERRORS = ""
 BASEPOWER = 1e3
-GRAPHLAYOUT = "kamada_kawai"
+GRAPHLAYOUT = "auto"
+LAYOUTLIMIT = 1000
 TIMEOUT = None 
 TITLE = False
 NODESIZE = 50
 NODESHAPE = None
 NODECOLOR = None
 LINKWIDTH = None
+FORCECONVERT = False
+
+# options copied to validate() worker processes
+SETTINGS = ["WORKDIR","BASEPOWER","GRAPHLAYOUT","LAYOUTLIMIT","TIMEOUT","TITLE",
+    "NODESIZE","NODESHAPE","NODECOLOR","LINKWIDTH","FORCECONVERT"]
 
 E_OK = 0
 E_FAILED = 1
@@ -69,6 +100,8 @@ E_TIMEOUT = 3
 
 RETURNCODE = 0
 
+AXES = None # reused by runtest() in validate() worker processes
+
 class ConverterException(Exception):
     pass
 
@@ -82,34 +115,51 @@ def error(msg,code=None):
     elif type(code) is Exception:
         raise code(msg)
 
+PHASEBITS = {"A":1, "B":2, "C":4, "D":8, "N":16, "S":32}
+
+def phasemask(phases):
+    mask = 0
+    for phase in phases:
+        mask |= PHASEBITS.get(phase,0)
+    return mask
+
+PHASECOLOR = ["black" if mask&7 == 7 else
+        f"#{255*(mask&1):02x}{255*(mask>>1&1):02x}{255*(mask>>2&1):02x}"
+    for mask in range(64)]
+PHASESHAPE = ["d" if mask&32 else "^" if mask&8 else "o" if mask&16 else "v"
+    for mask in range(64)]
+
 def color(phases):
     if NODECOLOR:
         return NODECOLOR
-    r = 255 if "A" in phases else 0
-    g = 255 if "B" in phases else 0
-    b = 255 if "C" in phases else 0
-    if [r,g,b] == [255,255,255]:
-        return "black"
-    else:
-        return f"#{r:02x}{g:02x}{b:02x}"
+    if type(phases) is str:
+        phases = phasemask(phases)
+    return PHASECOLOR[phases]
 
 def shape(phases):
     if NODESHAPE:
         return NODESHAPE
-    if "S" in phases:
-        return "d" 
-    elif "D" in phases:
-        return "^"
-    elif "N" in phases:
-        return "o"
-    else:
-        return "v"
+    if type(phases) is str:
+        phases = phasemask(phases)
+    return PHASESHAPE[phases]
+
+def uptodate(target,source):
+    return os.path.exists(target) and os.path.exists(source) \
+        and os.path.getmtime(target) >= os.path.getmtime(source)
+
+def figure():
+    """Create a file-only figure outside of pyplot and return its axes"""
+    fig = Figure(figsize=(10,7))
+    FigureCanvasAgg(fig)
+    return fig.add_subplot()
 
 def convert(inputfile=None,
         outputfile=None,
         showplot=False,
         jsonfile=None,
-        workdir="."):
+        workdir=".",
+        ax=None,
+        capture=False):
 
     if not inputfile:
         inputfile = INPUTFILE
@@ -120,21 +170,22 @@ def convert(inputfile=None,
     if not inputfile.endswith(".json"):
         if not jsonfile:
             jsonfile = os.path.splitext(inputfile)[0] + ".json"
-        result = subprocess.run(["gridlabd",
-                "-W",workdir,
-                "-I",inputfile,
-                "-o",jsonfile],
-            stdout = subprocess.PIPE,
-            stderr = subprocess.STDOUT)
         global OUTPUT
         global ERRORS
         OUTPUT = ""
         ERRORS = ""
-        if result.returncode:
-            ERRORS = result.stdout.decode()
-            return result.returncode
-        else:
-            OUTPUT = result.stdout.decode()
+        if FORCECONVERT or not uptodate(f"{workdir}/{jsonfile}",f"{workdir}/{inputfile}"):
+            result = subprocess.run(["gridlabd",
+                    "-W",workdir,
+                    "-I",inputfile,
+                    "-o",jsonfile],
+                stdout = subprocess.PIPE if capture else subprocess.DEVNULL,
+                stderr = subprocess.STDOUT if capture else subprocess.PIPE)
+            if result.returncode:
+                ERRORS = (result.stdout if capture else result.stderr).decode()
+                return result.returncode
+            elif capture:
+                OUTPUT = result.stdout.decode()
         inputfile = jsonfile
 
     if not outputfile and not showplot:
@@ -142,131 +193,368 @@ def convert(inputfile=None,
 
     # print(f"convert(inputfule={inputfile},ouputfile={outputfile},showplot={showplot},jsonfile={jsonfile},workdir={workdir})")
 
-    with open(f"{workdir}/{inputfile}",'r') as fh:
+    with open(f"{workdir}/{inputfile}",'rb') as fh:
         
-        glm = json.load(fh)
-        plt.figure(figsize=(10,7))
-        G = graph(glm)
-        if TITLE:
-            if TITLE == True:
-                title = os.path.splitext(os.path.basename(inputfile))[0]
-            else:
-                title = TITLE
-                print("TITLE =",title)
-            plt.suptitle(title)
-        if outputfile:
-            plt.savefig(outputfile)
-        if showplot:
-            plt.show()
-        plt.close()
+        glm = _json.loads(fh.read())
+        if ax is not None:
+            fig, axes = ax.figure, ax
+        elif showplot:
+            fig, axes = plt.subplots(figsize=(10,7))
+        else:
+            axes = figure()
+            fig = axes.figure
+        try:
+            graph(glm,axes)
+            if TITLE:
+                if TITLE == True:
+                    title = os.path.splitext(os.path.basename(inputfile))[0]
+                else:
+                    title = TITLE
+                    print("TITLE =",title)
+                fig.suptitle(title)
+            if outputfile:
+                fig.savefig(outputfile)
+            if showplot:
+                plt.show()
+        finally:
+            if ax is None and showplot:
+                plt.close(fig)
         return E_OK
     return E_FAILED
 
-def graph(glm):
-    G = networkx.Graph()
+def graph(glm,ax=None):
+    if ax is None:
+        ax = plt.gca()
+    else:
+        ax.clear()
     link = []
-    node = []
+    node_index = {}
+    node_list = []
+    node_colors = []
+    node_shapes = []
+    edge_from = []
+    edge_to = []
+    edge_colors = []
+    edge_power = []
     objects = glm['objects']
-    idlist = {}
     for name,data in objects.items():
-        idlist[name] = data['id']
-    for name,data in objects.items():
-        if 'from' in data and 'to' in data:
-            link.append(idlist[name])
-            from_node = idlist[data['from']]
-            to_node = idlist[data['to']]
-            if from_node not in node:
-                node.append(from_node)
-                phases = objects[data['from']]['phases']
-                G.add_node(from_node,
-                    color = color(phases),
-                    edge = "black" if "N" in phases else "white",
-                    shape = shape(phases))
-            if to_node not in node:
-                node.append(to_node)
-                phases = objects[data['to']]['phases']
-                G.add_node(to_node,
-                    color = color(phases),
-                    edge = "black" if "N" in phases else "white",
-                    shape = shape(phases))
-            weight = math.log10(abs(complex(data["power_out"]\
-                        .split()[0]).real/BASEPOWER)+10)
-            if weight <= 0:
-                raise ConverterException(f"{name}: weight<=0; power = {data['power_out']}")
-            G.add_edge(from_node, to_node,
-                    color = color(data["phases"]),
-                    weight = weight)
-
-    edge_colors = list(networkx.get_edge_attributes(G,'color').values())
-    edge_weights = list(networkx.get_edge_attributes(G,'weight').values())
-    node_colors = list(networkx.get_node_attributes(G,'color').values())
-    node_shapes = list(networkx.get_node_attributes(G,'shape').values())
-    node_edges = list(networkx.get_node_attributes(G,'edge').values())
-    node_pos = getattr(networkx,GRAPHLAYOUT+"_layout")(G)
-    networkx.draw_networkx_edges(G,pos=node_pos,
-        edge_color = edge_colors,
-        width = list(edge_weights),
-        )
-    shape_table = list(enumerate(node_shapes))
-    shape_names = list(node_pos.keys())
+        from_name = data.get('from')
+        to_name = data.get('to')
+        if from_name is not None and to_name is not None:
+            link.append(name)
+            from_obj = objects[from_name]
+            to_obj = objects[to_name]
+            from_node = node_index.get(from_obj['id'])
+            if from_node is None:
+                phases = phasemask(from_obj['phases'])
+                from_node = node_index[from_obj['id']] = len(node_list)
+                node_list.append(from_obj['id'])
+                node_colors.append(color(phases))
+                node_shapes.append(shape(phases))
+            to_node = node_index.get(to_obj['id'])
+            if to_node is None:
+                phases = phasemask(to_obj['phases'])
+                to_node = node_index[to_obj['id']] = len(node_list)
+                node_list.append(to_obj['id'])
+                node_colors.append(color(phases))
+                node_shapes.append(shape(phases))
+            edge_from.append(from_node)
+            edge_to.append(to_node)
+            edge_colors.append(color(data["phases"]))
+            edge_power.append(data["power_out"])
+
+    power = np.fromiter(map(complex,[value.split()[0] for value in edge_power]),
+        dtype = np.complex128,
+        count = len(edge_power)).real
+    weights = np.log10(np.abs(power)/BASEPOWER+10)
+    if (weights <= 0).any():
+        n = np.flatnonzero(weights <= 0)[0]
+        raise ConverterException(f"{link[n]}: weight<=0; power = {edge_power[n]}")
+    edge_weights = weights.tolist()
+
+    # nodes are numbered in order of appearance so positions can be indexed
+    if not node_list:
+        return {}
+    xy = layout(len(node_list),edge_from,edge_to)
+
+    # draw all links as one collection behind the nodes
+    segments = xy[np.array([edge_from,edge_to]).T]
+    ax.add_collection(matplotlib.collections.LineCollection(segments,
+        colors = edge_colors,
+        linewidths = LINKWIDTH or edge_weights,
+        antialiaseds = (1,),
+        zorder = 1,
+        ))
+    lower = segments.min(axis=(0,1))
+    upper = segments.max(axis=(0,1))
+    pad = 0.05*(upper-lower)
+    ax.update_datalim((lower-pad,upper+pad))
+    ax.autoscale_view()
+
+    # draw nodes with one collection per shape
+    node_colors = np.array(node_colors)
+    node_shapes = np.array(node_shapes)
     for node_shape in set(node_shapes):
-        index = [shape_names[i] for i,x in shape_table if x==node_shape]
-        colors = [node_colors[i] for i,x in enumerate(node_shapes) if x==node_shape]
-        networkx.draw_networkx_nodes(G,pos=node_pos,
-            nodelist = index,
-            node_color = colors,
-            node_size = NODESIZE,
-            node_shape = node_shape,
+        index = node_shapes == node_shape
+        ax.scatter(xy[index,0],xy[index,1],
+            s = NODESIZE,
+            c = node_colors[index],
+            marker = node_shape,
+            zorder = 2,
             )
-    return G
+    ax.tick_params(axis = "both",
+        which = "both",
+        bottom = False,
+        left = False,
+        labelbottom = False,
+        labelleft = False,
+        )
+    return dict(zip(node_list,xy))
+
+def kamada_kawai_energy(pos,invdist):
+    """Kamada-Kawai energy sum (|pi-pj|/dij-1)^2/2 and its gradient"""
+    dx = pos[:,0,None] - pos[None,:,0]
+    dy = pos[:,1,None] - pos[None,:,1]
+    r = np.hypot(dx,dy)
+    np.fill_diagonal(r,1)
+    offset = r*invdist - 1
+    np.fill_diagonal(offset,0)
+    scale = offset*invdist/r
+    cost = 0.5*np.sum(offset**2)
+    grad = 2*(scale.sum(axis=1)[:,None]*pos - scale@pos)
+    return cost, grad
+
+if numba:
+
+    def kamada_kawai_energy(pos,invdist):
+        """Kamada-Kawai energy sum (|pi-pj|/dij-1)^2/2 and its gradient"""
+        N = pos.shape[0]
+        grad = np.zeros((N,2))
+        cost = 0.0
+        for i in numba.prange(N):
+            gx = 0.0
+            gy = 0.0
+            for j in range(N):
+                if i == j:
+                    continue
+                dx = pos[i,0] - pos[j,0]
+                dy = pos[i,1] - pos[j,1]
+                r = math.sqrt(dx*dx+dy*dy)
+                offset = r*invdist[i,j] - 1
+                cost += 0.5*offset*offset
+                if r > 0:
+                    scale = offset*invdist[i,j]/r
+                    gx += scale*dx
+                    gy += scale*dy
+            grad[i,0] = 2*gx
+            grad[i,1] = 2*gy
+        return cost, grad
+
+    try:
+        kamada_kawai_energy = numba.njit(parallel=True,fastmath=True,cache=True)(kamada_kawai_energy)
+    except RuntimeError: # no cache location available
+        kamada_kawai_energy = numba.njit(parallel=True,fastmath=True)(kamada_kawai_energy)
+
+def kamada_kawai_solve(A):
+    """Kamada-Kawai positions of a connected network with adjacency matrix A"""
+    N = A.shape[0]
+    if N < 2:
+        return np.zeros((N,2))
+
+    # ideal distances are the hop counts between nodes
+    D = scipy.sparse.csgraph.shortest_path(A,directed=False,unweighted=True)
+    invdist = 1/(D+np.eye(N))
+    np.fill_diagonal(invdist,0)
+
+    # add a weak pull of the centroid to the origin
+    def energy(x):
+        pos = x.reshape(N,2)
+        cost, grad = kamada_kawai_energy(pos,invdist)
+        total = pos.sum(axis=0)
+        return cost + 0.5e-3*np.sum(total**2), (grad + 1e-3*total).ravel()
+
+    x0 = np.array([xy for xy in networkx.circular_layout(range(N)).values()])
+    result = scipy.optimize.minimize(energy,x0.ravel(),jac=True,method="L-BFGS-B")
+    return result.x.reshape(N,2)
+
+def adjacency(N,row,col):
+    return scipy.sparse.csr_matrix((np.ones(len(row)),(row,col)),shape=(N,N))
+
+def kamada_kawai(A):
+    """Kamada-Kawai positions of the nodes of adjacency matrix A"""
+    N = A.shape[0]
+    if N < 2:
+        return np.zeros((N,2))
+
+    count, labels = scipy.sparse.csgraph.connected_components(A,directed=False)
+    if count == 1:
+        pos = kamada_kawai_solve(A)
+    else:
+        # lay out each island separately, largest first, and place them side
+        # by side in rows at their natural scale of about one unit per link
+        islands = sorted((np.flatnonzero(labels==n) for n in range(count)),
+            key=len,reverse=True)
+        parts = [kamada_kawai_solve(A[island][:,island]) for island in islands]
+        lower = [part.min(axis=0) for part in parts]
+        upper = [part.max(axis=0) for part in parts]
+        size = [high-low for low,high in zip(lower,upper)]
+        width = max(size[0][0],math.sqrt(sum((w+1)*(h+1) for w,h in size)))
+        pos = np.zeros((N,2))
+        x = y = height = 0.0
+        for island,part,low,high,(w,h) in zip(islands,parts,lower,upper,size):
+            if x > 0 and x + w > width:
+                x = 0.0
+                y -= height+1
+                height = 0.0
+            pos[island] = part + (x-low[0],y-high[1])
+            x += w+1
+            height = max(height,h)
+    return networkx.rescale_layout(pos)
+
+def layout(N,edge_from,edge_to):
+    """Positions of nodes 0..N-1 linked by edge_from[i]--edge_to[i]"""
+    if GRAPHLAYOUT == "kamada_kawai" \
+            or GRAPHLAYOUT == "auto" and N <= LAYOUTLIMIT:
+        return kamada_kawai(adjacency(N,edge_from,edge_to))
+
+    # other layouts need a networkx graph
+    G = networkx.Graph()
+    G.add_nodes_from(range(N))
+    G.add_edges_from(zip(edge_from,edge_to))
+    if GRAPHLAYOUT != "auto":
+        node_pos = getattr(networkx,GRAPHLAYOUT+"_layout")(G)
+        return np.array([node_pos[n] for n in range(N)])
+
+    # contract leaf nodes into their parents, outermost first, only until
+    # the rest of the network is small enough for kamada_kawai
+    H = G.copy()
+    adj = H._adj # raw adjacency dicts, avoids view overhead
+    children = {}
+    removed = []
+    leaves = [n for n,nbrs in adj.items() if len(nbrs) == 1]
+    next_leaf = 0
+    while next_leaf < len(leaves) and len(adj) > LAYOUTLIMIT:
+        leaf = leaves[next_leaf]
+        next_leaf += 1
+        if len(adj[leaf]) != 1:
+            continue
+        up = next(iter(adj[leaf]))
+        if len(adj[up]) == 1:
+            continue # keep the last link of each tree
+        H.remove_node(leaf)
+        children.setdefault(up,[]).append(leaf)
+        removed.append(leaf)
+        if len(adj[up]) == 1:
+            leaves.append(up)
+
+    if len(adj) <= LAYOUTLIMIT:
+        nodes = list(H)
+        index = {n:i for i,n in enumerate(nodes)}
+        row = [index[u] for u,nbrs in adj.items() for v in nbrs]
+        col = [index[v] for u,nbrs in adj.items() for v in nbrs]
+        node_pos = dict(zip(nodes,kamada_kawai(adjacency(len(nodes),row,col))))
+    else:
+        node_pos = networkx.spring_layout(H,iterations=50,seed=0)
+    if not children:
+        return np.array([node_pos[n] for n in range(N)])
+
+    # count the leaves under each removed node, children are removed first
+    size = {}
+    for n in removed:
+        size[n] = sum(size[leaf] for leaf in children.get(n,[])) or 1
+
+    # place each removed subtree radially around the node it hangs from, in
+    # a sector facing away from its neighbors and sized by its leaf count,
+    # with each child getting a share of its parent's sector
+    if H.number_of_edges():
+        length = np.mean([np.linalg.norm(node_pos[u]-node_pos[v])
+            for u,nbrs in adj.items() for v in nbrs])
+    else:
+        length = 1/np.sqrt(len(adj))
+    center = np.mean(list(node_pos.values()),axis=0)
+    for root in [n for n in H if n in children]:
+        origin = np.mean([node_pos[n] for n in adj[root]],axis=0) if adj[root] else center
+        away = node_pos[root] - origin
+        if not away.any():
+            away = node_pos[root] - center
+        angle = math.atan2(away[1],away[0]) if away.any() else 0.0
+        width = min(math.pi,math.pi/6*sum(size[n] for n in children[root]))
+        todo = [(root,1,angle-width/2,width)]
+        while todo:
+            up, depth, start, width = todo.pop()
+            total = sum(size[n] for n in children[up])
+            for leaf in children[up]:
+                share = width*size[leaf]/total
+                theta = start + share/2
+                node_pos[leaf] = node_pos[root] \
+                    + depth*length*np.array([math.cos(theta),math.sin(theta)])
+                if leaf in children:
+                    todo.append((leaf,depth+1,start,share))
+                start += share
+    return np.array([node_pos[n] for n in range(N)])
+
+def initworker(settings):
+    globals().update(settings)
+    if numba:
+        numba.set_num_threads(1) # the pool already uses one worker per CPU
+    global AXES
+    AXES = figure()
+
+def runtest(file,testdir):
+    outputfile = f"{testdir}/{file.replace('.glm','.png')}"
+    try:
+        if TIMEOUT:
+                def timeout(signum,frame):
+                    raise ConverterTimeout(f"timeout after {TIMEOUT} seconds")
+                signal.signal(signal.SIGALRM,timeout)
+                signal.alarm(TIMEOUT)
+
+        if convert(file,
+                outputfile=outputfile,
+                workdir=testdir,
+                ax=AXES,
+                capture=True):
+            return "FAILED", ERRORS
+        else:
+            return "OK", OUTPUT
+    except ConverterTimeout as err:
+        return "TIMEOUT", ""
+    except Exception as err:
+        return "EXCEPTION", "".join(traceback.format_exception(err))
+    finally:
+        signal.alarm(0)
 
 def validate():
     tested = 0
     failed = 0
     TESTDIR = WORKDIR + "/autotest"
-    with open("validate.txt","w") as fh:
+    settings = {name:globals()[name] for name in SETTINGS}
+    with open("validate.txt","w") as fh, \
+            ProcessPoolExecutor(max_workers = os.cpu_count(),
+                mp_context = multiprocessing.get_context("spawn"),
+                initializer = initworker,
+                initargs = (settings,)) as pool:
+        tests = {}
         for file in sorted(os.listdir(TESTDIR)):
             if not file.endswith(".glm"):
                 continue
             outputfile = f"{TESTDIR}/{file.replace('.glm','.png')}"
-            print("Testing",file,flush=True,end='... ')
             if os.path.exists(outputfile):
+                tests[file] = None
+            else:
+                tests[file] = pool.submit(runtest,file,TESTDIR)
+        for file,test in tests.items():
+            print("Testing",file,flush=True,end='... ')
+            tested += 1
+            if test is None:
                 print("FOUND")
-                tested += 1
                 continue
-            try:
-                if TIMEOUT:
-                        def timeout(signum,frame):
-                            raise ConverterTimeout(f"timeout after {TIMEOUT} seconds")
-                        signal.signal(signal.SIGALRM,timeout)
-                        signal.alarm(TIMEOUT)
-
-                if convert(file,
-                        outputfile=outputfile,
-                        workdir=TESTDIR):
-                    failed += 1
-                    print("*** TEST",file,"FAILED\n" + ERRORS,file=fh,flush=True)
-                    print("",file=fh,flush=True)
-                    print("FAILED")
-                else:
-                    print("OK")
-                    print("*** TEST",file,"OK\n" + OUTPUT,file=fh,flush=True)
-                    print("",file=fh,flush=True)
-            except ConverterTimeout as err:
-                print("TIMEOUT")
-                print("*** TEST",file,"TIMEOUT\n",file=fh,flush=True)
-                print("",file=fh,flush=True)
+            status,output = test.result()
+            print(status)
+            print("*** TEST",file,status + "\n" + output,file=fh,flush=True)
+            print("",file=fh,flush=True)
+            if status != "OK":
                 failed += 1
-            except Exception as err:
-                print("EXCEPTION")
-                print("*** TEST",file,"EXCEPTION\n",file=fh,flush=True)
-                traceback.print_exception(err,file=fh)
-                print("",file=fh,flush=True)
-                failed += 1
-            finally:
-                tested += 1
-                signal.alarm(0)
-                plt.close()
     print(tested,"tested")
     print(failed,"failed")
     print(f"{(100-(100*failed)/tested):.0f}% passing")
@@ -276,52 +564,45 @@ def install():
     if os.system(f"cp {sys.argv[0]} $(gridlabd --version=install)/share/gridlabd") != 0:
         error("install failed")
 
+class ArgumentParser(argparse.ArgumentParser):
+
+    def error(self,msg):
+        error(msg,E_SYNTAX)
+
+def boolean(value):
+    if value.lower() in ["true","yes","on","1"]:
+        return True
+    if value.lower() in ["false","no","off","0"]:
+        return False
+    raise argparse.ArgumentTypeError(f"'{value}' is not a boolean")
+
 if __name__ == "__main__":
-    for arg in sys.argv[1:]:
-        spec = arg.split("=")
-        if len(spec) == 1:
-            tag = spec[0]
-            value = True
-        elif len(spec) == 2:
-            tag = spec[0]
-            value = spec[1]
-        else:
-            tag = spec[0]
-            value = "=".join(spec[1:])
-        if tag in ["-h","--help","help"]:
-            print(__doc__)
-            exit(E_OK)
-        elif tag in ["--install"]:
-            if sys.argv[1] != tag:
-                error("--install must be used alone",E_SYNTAX)
-            RETURNCODE = install()
-            exit(RETURNCODE)
-        elif tag in ['--color']:
-            NODECOLOR = value
-        elif tag in ['--width']:
-            NODEWIDTH = value
-        elif tag in ["-S","--show"]:
-            SHOWPLOT = value
-        elif tag in ["-W","--workdir"]:
-            WORKDIR = value
-        elif tag in ["-L","--layout"]:
-            GRAPHLAYOUT = value
-        elif tag in ["-B","--base"]:
-            BASEPOWER = float(value)
-        elif tag in ["-t","--timeout"]:
-            TIMEOUT = int(value)
-        elif tag in ["-T","--title"]:
-            TITLE = value            
-        elif tag in ["-i","--input"]:
-            INPUTFILE = value
-        elif tag in ["-o","--output"]:
-            OUTPUTFILE = value
-        elif tag in ["-N","--nodeshape"]:
-            NODESHAPE = value
-        elif tag in ["-Z","--nodesize"]:
-            NODESIZE = int(value)
-        else:
-            error(f"option '{arg}' is invalid",1)
+    if set(sys.argv[1:]) & {"-h","--help","help"}:
+        print(__doc__)
+        exit(E_OK)
+    if "--install" in sys.argv[1:]:
+        if sys.argv[1:] != ["--install"]:
+            error("--install must be used alone",E_SYNTAX)
+        RETURNCODE = install()
+        exit(RETURNCODE)
+
+    parser = ArgumentParser(prog=BASENAME,add_help=False,allow_abbrev=False)
+    parser.add_argument("-B","--base",dest="BASEPOWER",type=float,default=BASEPOWER)
+    parser.add_argument("--color",dest="NODECOLOR",default=NODECOLOR)
+    parser.add_argument("--force-reconvert",dest="FORCECONVERT",action="store_true")
+    parser.add_argument("-i","--input",dest="INPUTFILE",default=INPUTFILE)
+    parser.add_argument("-L","--layout",dest="GRAPHLAYOUT",default=GRAPHLAYOUT)
+    parser.add_argument("-N","--nodeshape",dest="NODESHAPE",default=NODESHAPE)
+    parser.add_argument("-o","--output",dest="OUTPUTFILE",default=OUTPUTFILE)
+    parser.add_argument("-S","--show",dest="SHOWPLOT",type=boolean,nargs="?",const=True,default=SHOWPLOT)
+    parser.add_argument("-t","--timeout",dest="TIMEOUT",type=int,default=TIMEOUT)
+    parser.add_argument("-T","--title",dest="TITLE",nargs="?",const=True,default=TITLE)
+    parser.add_argument("-W","--workdir",dest="WORKDIR",default=WORKDIR)
+    parser.add_argument("--width",dest="LINKWIDTH",type=int,default=LINKWIDTH)
+    parser.add_argument("-Z","--nodesize",dest="NODESIZE",type=int,default=NODESIZE)
+    globals().update(vars(parser.parse_args()))
+    if not SHOWPLOT:
+        plt.switch_backend("Agg") # no interactive backend needed to save files
 
     if len(sys.argv) == 1 or not INPUTFILE:
 